@@ -3,6 +3,7 @@
 
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
 import re
 import sys
 from datetime import datetime
@@ -27,7 +28,21 @@ VERSION = "2.0"
 
 # Define global variables
 ID_SYSTEM_USED = EIdentifierTypes.ENSEMBL
-transcriptProteinTable = {}
+# Arguments shared by all peptide lengths, set once per worker process by init_peptide_worker
+peptideWorkerArgs = None
+
+# Precompiled patterns for parsing mutation syntaxes, e.g. "Lys4Met" (substitution), "Ser7" (deletion) and positions
+SUBSTITUTION_PATTERN = re.compile(r"([a-zA-Z]+)([0-9]+)([a-zA-Z]+)")
+DELETION_PATTERN = re.compile(r"([a-zA-Z]+)([0-9]+)")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+# Names of the epytope variation types, indexed by VariationType (SNP=0, DEL=1, INS=2, FSDEL=3, FSINS=4, UNKNOWN=5)
+VARIATION_TYPE_NAMES = ("SNP", "DEL", "INS", "FSDEL", "FSINS", "UNKNOWN")
+# Names of boolean variant properties, indexed by their value
+BOOLEAN_NAMES = ("False", "True")
+# Minimum number of peptides of one length for which indexing all substrings of that length of the reference proteome
+# is faster than searching each peptide in the joined proteome (~1.6s per length vs. ~7ms per peptide for 11M residues)
+SUBSTRING_SEARCH_MIN_PEPTIDES = 250
 
 # Set up logging (epytope uses logging as well, so we have to adapt the existing logger)
 logger = logging.getLogger()
@@ -42,6 +57,28 @@ if not logger.hasHandlers():
     handler.setFormatter(formatter)
     logger.addHandler(handler)
 
+class CachedMartsAdapter(MartsAdapter):
+    """
+    MartsAdapter that memoizes BioMart lookups. Transcripts are queried per variant, so the dataset attributes and
+    the information of every transcript (including unavailable ones) are only fetched once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dataset_attributes_cache = {}
+        self.transcript_information_cache = {}
+
+    def get_dataset_attributes(self, dataset_name):
+        if dataset_name not in self.dataset_attributes_cache:
+            self.dataset_attributes_cache[dataset_name] = super().get_dataset_attributes(dataset_name)
+        return self.dataset_attributes_cache[dataset_name]
+
+    def get_transcript_information(self, transcript_id, **kwargs):
+        key = (transcript_id, kwargs.get("type"), kwargs.get("_db"))
+        if key not in self.transcript_information_cache:
+            self.transcript_information_cache[key] = super().get_transcript_information(transcript_id, **kwargs)
+        return self.transcript_information_cache[key]
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="""EPAA - Epitope Prediction And Annotation \n Pipeline for prediction of MHC class I and II epitopes from variants or peptides for a list of specified alleles.
@@ -55,6 +92,7 @@ def parse_args():
     parser.add_argument("--max_length", help="Maximum peptide length of mutated peptides", type=int, default=14)
     parser.add_argument("--genome_reference", help="Reference, retrieved information will be based on this ensembl version", default="https://grch37.ensembl.org/")
     parser.add_argument("--proteome_reference", help="Specify reference proteome fasta for self-filtering peptides from variants")
+    parser.add_argument("--cpus", help="Number of processes used to generate mutated peptides", type=int, default=1)
     parser.add_argument("--peptide_col_name", help="Name of the column containing the peptide sequences", type=str, default="sequence")
     parser.add_argument("--version", help="Script version", action="version", version=VERSION)
 
@@ -118,9 +156,8 @@ def determine_zygosity(record):
             else:
                 isHomozygous = False
     else:
-        for sample in record.samples:
-            if "GT" in sample.data:
-                isHomozygous = sample.data["GT"] == "1/1"
+        # PyVCF classifies the genotype of each call (hom_ref=0, het=1, hom_alt=2), missing or absent GT is None
+        isHomozygous = any(sample.gt_type == 2 for sample in record.samples)
     return isHomozygous
 
 
@@ -165,10 +202,8 @@ def read_vcf(filename, pass_only=True):
     VEP_KEY = "CSQ"
     SNPEFF_KEY = "ANN"
 
-    variants = list()
-    with open(filename) as tsvfile:
-        vcf_reader = vcf.Reader(tsvfile)
-        variants = [r for r in vcf_reader]
+    # the reader parses the header on construction, records are streamed from the file in the loop below
+    vcf_reader = vcf.Reader(filename=filename)
 
     # list of mandatory (meta)data
     exclusion_list = ["ANN", "CSQ"]
@@ -183,17 +218,17 @@ def read_vcf(filename, pass_only=True):
             vep_fields[field.strip().lower()] = idx
         vep_header_available = True
 
-    # get lists of additional metadata
-    metadata_list = set(vcf_reader.infos.keys()) - set(exclusion_list)
-    metadata_list.update(set(inclusion_list))
-    format_list = set(vcf_reader.formats.keys())
+    # get lists of additional metadata, computed once as sorted tuples to iterate them in a stable order for each record
+    metadata_list = tuple(sorted((set(vcf_reader.infos.keys()) - set(exclusion_list)) | set(inclusion_list)))
+    format_list = tuple(sorted(vcf_reader.formats.keys()))
     final_metadata_list = []
 
-    dict_vars = {}
     list_vars = []
+    # variants grouped by the transcripts they are annotated to, built while parsing the records
+    transToVar = {}
     transcript_ids = []
 
-    for num, record in enumerate(variants):
+    for num, record in enumerate(vcf_reader):
         chromosome = record.CHROM.strip("chr")
         genomic_position = record.POS
         variation_dbid = record.ID
@@ -214,56 +249,34 @@ def read_vcf(filename, pass_only=True):
         INSERTION => seqp[pos:pos] = obs (insert at that position)
         DELETION => s = slice(pos, pos+len(ref)) (create slice that will be removed) del seq[s] (remove)
         """
+        # zygosity and annotations are properties of the record, only the variant type depends on the alternative allele
+        isHomozygous = determine_zygosity(record)
+        snpeff_annotation = record.INFO.get(SNPEFF_KEY)
+        vep_annotation = record.INFO.get(VEP_KEY)
         for alt in alternative_list:
-            isHomozygous = determine_zygosity(record)
             vt = determine_variant_type(record, alt)
 
             # check if we have SNPEFF or VEP annotated variants, otherwise abort
-            if record.INFO.get(SNPEFF_KEY, False) or record.INFO.get(VEP_KEY, False):
+            if snpeff_annotation or vep_annotation:
                 isSynonymous = False
                 consequence = "unknown"
                 coding = dict()
-                types = []
                 # SNPEFF annotation
-                if SNPEFF_KEY in record.INFO:
-                    for annraw in record.INFO[SNPEFF_KEY]:
+                if snpeff_annotation:
+                    for annraw in snpeff_annotation:
+                        # fields: allele, annotation, impact, gene name, gene id, feature type, feature id, transcript biotype,
+                        # rank, HGVS.c, HGVS.p, cDNA pos, CDS pos, AA pos, distance, errors
                         annots = annraw.split("|")
                         if len(annots) != 16:
                             logger.warning( "read_vcf: Omitted row! Mandatory columns not present in annotation field (ANN). \n Have you annotated your VCF file with SnpEff?")
                             continue
-                        (
-                            obs,
-                            a_mut_type,
-                            impact,
-                            a_gene,
-                            a_gene_id,
-                            feature_type,
-                            transcript_id,
-                            exon,
-                            tot_exon,
-                            trans_coding,
-                            prot_coding,
-                            cdna,
-                            cds,
-                            aa,
-                            distance,
-                            warnings,
-                        ) = annots
-                        types.append(a_mut_type)
-                        tpos = 0
-                        ppos = 0
-                        positions = ""
-                        isSynonymous = "synonymous_variant" in a_mut_type
-                        gene = a_gene_id
-
-                        # get cds/protein positions and convert mutation syntax to epytope format
-                        if trans_coding != "":
-                            positions = re.findall(r"\d+", trans_coding)
-                            ppos = int(positions[0]) - 1
-
-                        if prot_coding != "":
-                            positions = re.findall(r"\d+", prot_coding)
-                            tpos = int(positions[0]) - 1
+                        a_mut_type = annots[1]
+                        transcript_id = annots[6]
+                        trans_coding = annots[9]
+                        prot_coding = annots[10]
+                        # combined annotations are "&"-separated, compare whole terms to not match e.g. "non_synonymous_variant"
+                        isSynonymous = "synonymous_variant" in a_mut_type.split("&")
+                        gene = annots[4]
 
                         # with the latest epytope release (3.3.1), we can now handle full transcript IDs
                         if "NM" in transcript_id:
@@ -273,15 +286,21 @@ def read_vcf(filename, pass_only=True):
                         if not prot_coding or "stop_gained" in a_mut_type:
                             continue
 
+                        # get cds/protein positions and convert mutation syntax to epytope format
+                        ppos = 0
+                        if trans_coding != "":
+                            ppos = int(DIGITS_PATTERN.search(trans_coding).group()) - 1
+                        tpos = int(DIGITS_PATTERN.search(prot_coding).group()) - 1
+
                         coding[transcript_id] = MutationSyntax(transcript_id, ppos, tpos, trans_coding, prot_coding)
                         transcript_ids.append(transcript_id)
                 else:
                     if not vep_header_available:
                         logger.warning("No CSQ definition found in header, trying to map to default VEP format string.")
-                    for annotation in record.INFO[VEP_KEY]:
+                    for annotation in vep_annotation:
                         split_annotation = annotation.split("|")
-                        isSynonymous = "synonymous" in split_annotation[vep_fields["consequence"]]
                         consequence = split_annotation[vep_fields["consequence"]]
+                        isSynonymous = "synonymous_variant" in consequence.split("&")
                         gene = split_annotation[vep_fields["gene"]]
                         c_coding = split_annotation[vep_fields["hgvsc"]]
                         p_coding = split_annotation[vep_fields["hgvsp"]]
@@ -342,101 +361,108 @@ def read_vcf(filename, pass_only=True):
                             else:
                                 format_value = sample[format_key]
                             var.log_metadata(format_header, format_value)
-                    dict_vars[var] = var
                     list_vars.append(var)
+                    for trans_id in coding:
+                        transToVar.setdefault(trans_id, []).append(var)
             else:
                 logger.warning(f"No supported variant annotation string found for record {record}. Skipping.")
-    transToVar = {}
-
     # fix because of memory/timing issues due to combinatorial explosion
-
-    for variant in list_vars:
-        for trans_id in variant.coding.keys():
-            transToVar.setdefault(trans_id, []).append(variant)
-
+    # variants of large transcript groups are treated as homozygous, isHomozygous is a plain attribute and can be set in place
     for tId, vs in transToVar.items():
         if len(vs) > 10:
             for v in vs:
-                vs_new = Variant(v.id, v.type, v.chrom, v.genomePos, v.ref, v.obs, v.coding, True, v.isSynonymous)
-                vs_new.gene = v.gene
-                for m in metadata_name:
-                    vs_new.log_metadata(m, v.get_metadata(m))
-                dict_vars[v] = vs_new
+                v.isHomozygous = True
 
-    return dict_vars.values(), transcript_ids, final_metadata_list
+    return list_vars, transcript_ids, final_metadata_list
 
-def create_protein_column_value(pep, database_id):
+def create_protein_column_value(pep, transcripts, database_id, transcript_protein_table):
     # retrieve Ensembl protein ID for given transcript IDs, if we want to provide additional protein ID types, adapt here
     # we have to catch cases where no protein information is available, e.g. if there are issues on BioMart side
-    if transcriptProteinTable is None:
+    if transcript_protein_table is None:
         logger.warning(f"Protein mapping not available for peptide {str(pep)}")
         return ""
 
     all_proteins = [
         # split by : otherwise epytope generator suffix included
-        transcriptProteinTable.query(f'transcript_id == "{transcript.transcript_id.split(":")[0]}"')[database_id]
-        for transcript in set(pep.get_all_transcripts())
+        transcript_protein_table.get(transcript.transcript_id.split(":")[0], {}).get(database_id, [])
+        for transcript in transcripts
     ]
     # Use dict.fromkeys to remove duplicates and preserve order
     database_ids = ",".join(dict.fromkeys(item if not pd.isna(item) else '' for sublist in all_proteins for item in sublist))
     return database_ids
 
 
-def create_transcript_column_value(pep):
+def create_transcript_column_value(transcripts):
     # split by : otherwise epytope generator suffix included
-    return ",".join(set([transcript.transcript_id.split(":")[0] for transcript in set(pep.get_all_transcripts())]))
+    return ",".join(set([transcript.transcript_id.split(":")[0] for transcript in transcripts]))
 
 
-def create_mutationsyntax_column_value(pep, pep_dictionary):
+def create_mutationsyntax_column_value(variants):
     syntaxes = []
-    for variant in set(pep_dictionary[pep]):
+    for variant in variants:
         for coding in variant.coding:
             syntaxes.append(variant.coding[coding])
     return ",".join(set([mutationSyntax.aaMutationSyntax for mutationSyntax in syntaxes]))
 
 
-def create_mutationsyntax_genome_column_value(pep, pep_dictionary):
+def create_mutationsyntax_genome_column_value(variants):
     syntaxes = []
-    for variant in set(pep_dictionary[pep]):
+    for variant in variants:
         for coding in variant.coding:
             syntaxes.append(variant.coding[coding])
     return ",".join(set([mutationSyntax.cdsMutationSyntax for mutationSyntax in syntaxes]))
 
 
-def create_gene_column_value(pep, pep_dictionary):
-    return ",".join(set([variant.gene for variant in set(pep_dictionary[pep])]))
+def create_gene_column_value(variants):
+    return ",".join(set([variant.gene for variant in variants]))
 
 
-def create_variant_pos_column_value(pep, pep_dictionary):
-    return ",".join(set([f"{variant.genomePos}" for variant in set(pep_dictionary[pep])]))
+def create_variant_pos_column_value(variants):
+    return ",".join(set([f"{variant.genomePos}" for variant in variants]))
 
 
-def create_variant_chr_column_value(pep, pep_dictionary):
-    return ",".join(set([f"{variant.chrom}" for variant in set(pep_dictionary[pep])]))
+def create_variant_chr_column_value(variants):
+    return ",".join(set([f"{variant.chrom}" for variant in variants]))
+
+
+def join_flags(flags, names):
+    """
+    Join the names of all bits set in the integer flags, e.g. join_flags(0b101, VARIATION_TYPE_NAMES) returns "SNP,INS".
+    """
+    return ",".join([name for i, name in enumerate(names) if flags & (1 << i)])
 
 
-def create_variant_type_column_value(pep, pep_dictionary):
-    types = {0: "SNP", 1: "DEL", 2: "INS", 3: "FSDEL", 4: "FSINS", 5: "UNKNOWN"}
-    return ",".join(set([types[variant.type] for variant in set(pep_dictionary[pep])]))
+def create_variant_type_column_value(variants):
+    # Accumulate the distinct variation types as bit flags and expand them to names once
+    flags = 0
+    for variant in variants:
+        flags |= 1 << variant.type
+    return join_flags(flags, VARIATION_TYPE_NAMES)
 
 
-def create_variant_syn_column_value(pep, pep_dictionary):
-    return ",".join(set([str(variant.isSynonymous) for variant in set(pep_dictionary[pep])]))
+def create_variant_syn_column_value(variants):
+    flags = 0
+    for variant in variants:
+        flags |= 1 << bool(variant.isSynonymous)
+    return join_flags(flags, BOOLEAN_NAMES)
 
 
-def create_variant_hom_column_value(pep, pep_dictionary):
-    return ",".join(set([str(variant.isHomozygous) for variant in set(pep_dictionary[pep])]))
+def create_variant_hom_column_value(variants):
+    flags = 0
+    for variant in variants:
+        flags |= 1 << bool(variant.isHomozygous)
+    return join_flags(flags, BOOLEAN_NAMES)
 
 
-def create_coding_column_value(pep, pep_dictionary):
-    return ",".join(set([str(variant.coding) for variant in set(pep_dictionary[pep])]))
+def create_coding_column_value(variants):
+    return ",".join(set([str(variant.coding) for variant in variants]))
 
 
 def create_metadata_column_value(pep, c, pep_dictionary):
     meta = set(
         [
             str(variant.get_metadata(c)[0])
-            for variant in set(pep_dictionary[pep[0]])
+            for variant in pep_dictionary[pep]
             if len(variant.get_metadata(c)) != 0
         ]
     )
@@ -446,13 +472,13 @@ def create_metadata_column_value(pep, c, pep_dictionary):
         return ",".join(meta)
 
 
-def create_wt_seq_column_value(pep, wtseqs):
-    transcripts = [transcript for transcript in set(pep.get_all_transcripts())]
+def create_wt_seq_column_value(pep, transcripts, wtseqs):
+    pep_wtseqs = wtseqs.get(str(pep), {})
     wild_type = set(
         [
-            str(wtseqs["{}_{}".format(str(pep), transcript.transcript_id)])
+            str(pep_wtseqs[transcript.transcript_id])
             for transcript in transcripts
-            if bool(transcript.vars) and "{}_{}".format(str(pep), transcript.transcript_id) in wtseqs
+            if bool(transcript.vars) and transcript.transcript_id in pep_wtseqs
         ]
     )
     if len(wild_type) == 0:
@@ -462,11 +488,11 @@ def create_wt_seq_column_value(pep, wtseqs):
 
 
 def generate_wt_seqs(peptides):
+    # wild type sequences per peptide and transcript, e.g. {"AASNMKDC": {"ENST01:epytope_0": "AARNMKDC"}}
     wt_dict = {}
 
-    r = re.compile("([a-zA-Z]+)([0-9]+)([a-zA-Z]+)")
-    d_pattern = re.compile("([a-zA-Z]+)([0-9]+)")
     for x in peptides:
+        pep_wt_dict = wt_dict.setdefault(str(x), {})
         trans = x.get_all_transcripts()
         for t in trans:
             mut_seq = [a for a in x]
@@ -483,37 +509,136 @@ def generate_wt_seqs(peptides):
                         if v.type in [3, 4, 5] or "?" in mut_syntax:
                             not_available = True
                         elif v.type in [1]:
-                            m = d_pattern.match(mut_syntax.split(".")[1])
+                            m = DELETION_PATTERN.match(mut_syntax.split(".")[1])
                             wt = SeqUtils.seq1(m.groups()[0])
                             mut_seq.insert(key, wt)
                         elif v.type in [2]:
                             not_available = True
                         else:
-                            m = r.match(mut_syntax.split(".")[1])
+                            m = SUBSTITUTION_PATTERN.match(mut_syntax.split(".")[1])
                             if m is None:
                                 not_available = True
                             else:
                                 wt = SeqUtils.seq1(m.groups()[0])
                                 mut_seq[key] = wt
             if not_available:
-                wt_dict[f"{str(x)}_{t.transcript_id}"] = np.nan
+                pep_wt_dict[t.transcript_id] = np.nan
             elif variant_available:
-                wt_dict[f"{str(x)}_{t.transcript_id}"] = "".join(mut_seq)
+                pep_wt_dict[t.transcript_id] = "".join(mut_seq)
     return wt_dict
 
 # TODO potential improvement in epytope
-def create_peptide_variant_dictionary(peptides):
+def create_peptide_variant_dictionary(peptides, pep_transcripts):
     pep_to_variants = {}
     for pep in peptides:
-        transcript_ids = [x.transcript_id for x in set(pep.get_all_transcripts())]
-        variants = []
+        transcript_ids = [x.transcript_id for x in pep_transcripts[pep]]
+        variants = set()
         for t in transcript_ids:
-            variants.extend([v for v in pep.get_variants_by_protein(t)])
+            variants.update(pep.get_variants_by_protein(t))
         pep_to_variants[pep] = variants
     return pep_to_variants
 
 
-def generate_peptides_from_variants( variants: Variant, martsadapter: MartsAdapter, metadata: list, minlength: int, maxlength: int ) -> Tuple[pd.DataFrame, list]:
+# Columns of the mutated peptides output in the order of the values returned by create_peptide_row
+PEPTIDE_COLUMNS = [
+    "sequence",
+    "chr",
+    "pos",
+    "gene",
+    "transcripts",
+    "proteins",
+    "refseq",
+    "uniprot",
+    "variant type",
+    "synonymous",
+    "homozygous",
+    "variant_details_gene",
+    "variant_details_protein",
+]
+
+
+def create_peptide_row(pep, transcripts, pep_dictionary, transcript_protein_table):
+    """
+    Create the values of all PEPTIDE_COLUMNS for a mutated peptide in a single pass.
+    The variants of the peptide are shared by all variant column values,
+    the transcripts of the peptide are shared by the transcript and protein column values.
+    """
+    variants = pep_dictionary[pep]
+    return (
+        str(pep),
+        create_variant_chr_column_value(variants),
+        create_variant_pos_column_value(variants),
+        create_gene_column_value(variants),
+        create_transcript_column_value(transcripts),
+        create_protein_column_value(pep, transcripts, "ensembl_id", transcript_protein_table),
+        create_protein_column_value(pep, transcripts, "refseq_id", transcript_protein_table),
+        create_protein_column_value(pep, transcripts, "uniprot_id", transcript_protein_table),
+        create_variant_type_column_value(variants),
+        create_variant_syn_column_value(variants),
+        create_variant_hom_column_value(variants),
+        create_mutationsyntax_genome_column_value(variants),
+        create_mutationsyntax_column_value(variants),
+    )
+
+
+def generate_peptides_of_length(prots: list, peplen: int, metadata: list, transcript_protein_table: Optional[dict]) -> Optional[pd.DataFrame]:
+    """
+    Generate mutated peptides of a single length from a list of mutated proteins.
+    Args:
+        prots: List of mutated epytope.Core.Protein objects.
+        peplen: Length of peptides to generate.
+        metadata: List of metadata columns to include in the output.
+        transcript_protein_table: Mapping of transcript IDs to ensembl, refseq and uniprot IDs or None if not available.
+    Returns:
+        mutated_peptides_len_df: DataFrame containing mutated peptides and metadata or None if no peptide was created by a variant.
+    """
+    # Generate peptides from all mutated proteins and filter out peptides that are not created by a variant in the same pass
+    num_peptides = 0
+    mutated_peptides = []
+    for p in generator.generate_peptides_from_proteins(prots, peplen):
+        num_peptides += 1
+        if p.is_created_by_variant():
+            mutated_peptides.append(p)
+    logger.info(f"Generated {num_peptides} peptides of length {peplen}.")
+    logger.info(f"Generated {len(mutated_peptides)} peptides of length {peplen} that were created by a variant.")
+    if len(mutated_peptides) == 0:
+        return None
+
+    # Add metadata to mutated peptides
+    # Collect the transcripts of each peptide once, they are needed for several columns
+    peptide_transcripts = {p: set(p.get_all_transcripts()) for p in mutated_peptides}
+    peptide_variants_dict = create_peptide_variant_dictionary(mutated_peptides, peptide_transcripts)
+    mutated_peptides_len_df = pd.DataFrame(
+        [create_peptide_row(p, peptide_transcripts[p], peptide_variants_dict, transcript_protein_table) for p in mutated_peptides],
+        columns=PEPTIDE_COLUMNS
+    )
+    # Add additional metadata to mutated peptides, deduplicated in first-seen order to get the same columns in every process
+    for col in dict.fromkeys(metadata):
+        mutated_peptides_len_df[col] = [create_metadata_column_value(p, col, peptide_variants_dict) for p in mutated_peptides]
+    # Add wild type sequences to mutated peptides if Protein ID is available
+    # TODO: Investigate if mapping can be improved -> ensemble_id is present
+    try:
+        wt_sequences = generate_wt_seqs(mutated_peptides)
+        mutated_peptides_len_df["wildtype"] = [create_wt_seq_column_value(p, peptide_transcripts[p], wt_sequences) for p in mutated_peptides]
+    except Exception as e:
+        logger.warning("Missing protein identifier! Could not parse protein sequences for wildtype annontation.")
+
+    return mutated_peptides_len_df
+
+def init_peptide_worker(prots: list, metadata: list, transcript_protein_table: Optional[dict]):
+    """
+    Store the arguments shared by all peptide lengths in a worker process.
+    They are sent to each worker once when it starts instead of once per peptide length.
+    """
+    global peptideWorkerArgs
+    peptideWorkerArgs = (prots, metadata, transcript_protein_table)
+
+def generate_peptides_of_length_in_worker(peplen: int) -> Optional[pd.DataFrame]:
+    """Generate mutated peptides of a single length from the arguments stored in the worker process."""
+    prots, metadata, transcript_protein_table = peptideWorkerArgs
+    return generate_peptides_of_length(prots, peplen, metadata, transcript_protein_table)
+
+def generate_peptides_from_variants( variants: Variant, martsadapter: MartsAdapter, metadata: list, minlength: int, maxlength: int, transcript_protein_table: Optional[dict], cpus: int = 1 ) -> Tuple[pd.DataFrame, list]:
     """
     Generate mutated peptides ranging between min and max length from a list of epytore.Core.Variants.
     Args:
@@ -522,6 +647,8 @@ def generate_peptides_from_variants( variants: Variant, martsadapter: MartsAdapt
         metadata: List of metadata columns to include in the output.
         minlength: Minimum length of peptides to generate.
         maxlength: Maximum length of peptides to generate.
+        transcript_protein_table: Mapping of transcript IDs to ensembl, refseq and uniprot IDs or None if not available.
+        cpus: Number of processes used to generate peptides of different lengths.
     Returns:
         mutated_peptides_df: DataFrame containing mutated peptides and metadata.
         prots: List of mutated proteins.
@@ -538,52 +665,23 @@ def generate_peptides_from_variants( variants: Variant, martsadapter: MartsAdapt
     prots = []
     for t in transcripts:
         try:
-            prots.extend([p for p in generator.generate_proteins_from_transcripts([t])])
+            prots.extend(generator.generate_proteins_from_transcripts([t]))
         except Exception:
             logger.warning(f"Could not generate proteins for transcript {t}. Skipping.")
 
-    # Iterate over each peptide length and generate peptides from mutated proteins and filter out peptides that are not created by a variant
-    mutated_peptides_df = []
-    for peplen in range(minlength, maxlength):
-        # Generate peptides from all mutated proteins
-        all_peptides_from_mutated_proteins = [x for x in generator.generate_peptides_from_proteins(prots, peplen)]
-        logger.info(f"Generated {len(all_peptides_from_mutated_proteins)} peptides of length {peplen}.")
-        # Filter out peptides that are not created by a variant
-        mutated_peptides = [p for p in all_peptides_from_mutated_proteins if p.is_created_by_variant()]
-        logger.info(f"Generated {len(mutated_peptides)} peptides of length {peplen} that were created by a variant.")
-        if len(mutated_peptides) == 0:
-            continue
-
-        # Add metadata to mutated peptides
-        peptide_variants_dict = create_peptide_variant_dictionary(mutated_peptides)
-        mutated_peptides_dict = {
-            "sequence": [str(p) for p in mutated_peptides],
-            "chr": [create_variant_chr_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "pos": [create_variant_pos_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "gene": [create_gene_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "transcripts": [create_transcript_column_value(p) for p in mutated_peptides],
-            "proteins": [create_protein_column_value(p, "ensembl_id") for p in mutated_peptides],
-            "refseq": [create_protein_column_value(p, "refseq_id") for p in mutated_peptides],
-            "uniprot": [create_protein_column_value(p, "uniprot_id") for p in mutated_peptides],
-            "variant type": [create_variant_type_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "synonymous": [create_variant_syn_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "homozygous": [create_variant_hom_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "variant_details_gene": [create_mutationsyntax_genome_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-            "variant_details_protein": [create_mutationsyntax_column_value(p, peptide_variants_dict) for p in mutated_peptides],
-        }
-        mutated_peptides_len_df = pd.DataFrame(mutated_peptides_dict)
-        # Add additional metadata to mutated peptides
-        for col in set(metadata):
-            mutated_peptides_len_df[col] = mutated_peptides_len_df.apply(lambda row: create_metadata_column_value(row, col, peptide_variants_dict), axis=1)
-        # Add wild type sequences to mutated peptides if Protein ID is available
-        # TODO: Investigate if mapping can be improved -> ensemble_id is present
-        try:
-            wt_sequences = generate_wt_seqs(mutated_peptides)
-            mutated_peptides_len_df["wildtype"] = [create_wt_seq_column_value(p, wt_sequences) for p in mutated_peptides]
-        except Exception as e:
-            logger.warning("Missing protein identifier! Could not parse protein sequences for wildtype annontation.")
-
-        mutated_peptides_df.append(mutated_peptides_len_df)
+    # Generate peptides of each length independently, in parallel if more than one cpu is available
+    peptide_lengths = range(minlength, maxlength)
+    if cpus > 1 and len(peptide_lengths) > 1:
+        # The shared arguments are passed explicitly to each worker, workers do not rely on inheriting globals via fork
+        with ProcessPoolExecutor(
+            max_workers=min(cpus, len(peptide_lengths)),
+            initializer=init_peptide_worker,
+            initargs=(prots, metadata, transcript_protein_table),
+        ) as executor:
+            mutated_peptides_df = list(executor.map(generate_peptides_of_length_in_worker, peptide_lengths))
+    else:
+        mutated_peptides_df = [generate_peptides_of_length(prots, peplen, metadata, transcript_protein_table) for peplen in peptide_lengths]
+    mutated_peptides_df = [df for df in mutated_peptides_df if df is not None]
 
     if len(mutated_peptides_df) == 0:
         logger.warning("No mutated peptides found.")
@@ -602,6 +700,37 @@ def parse_fasta(fasta_file: str) -> Dict[str, str]:
     """
     return {record.id: str(record.seq) for record in SeqIO.parse(fasta_file, "fasta")}
 
+def find_peptides_in_proteome(peptides, proteome: Dict[str, str]) -> set:
+    """
+    Find the peptides that are contained in any protein of a proteome.
+    Peptides are grouped by length. Large groups are intersected with all substrings of that length of each protein,
+    such that the runtime scales with the size of the proteome and not with the number of peptides.
+    Small groups are searched peptide by peptide in the joined proteome, which is faster for few peptides.
+    Args:
+        peptides: Iterable of peptide sequences.
+        proteome: Dictionary with the protein id as key and the protein sequence as value.
+    Returns:
+        A set of all peptides found in the proteome.
+    """
+    peptides_by_length = {}
+    for pep in peptides:
+        peptides_by_length.setdefault(len(pep), set()).add(pep)
+    found_peptides = set()
+    substring_peptides_by_length = {}
+    joined_proteome = None
+    for length, length_peptides in peptides_by_length.items():
+        if len(length_peptides) >= SUBSTRING_SEARCH_MIN_PEPTIDES:
+            substring_peptides_by_length[length] = length_peptides
+            continue
+        # proteins are separated by "|" to not match across them
+        if joined_proteome is None:
+            joined_proteome = "|".join(proteome.values())
+        found_peptides.update(pep for pep in length_peptides if pep in joined_proteome)
+    for prot in proteome.values():
+        for length, length_peptides in substring_peptides_by_length.items():
+            found_peptides.update(length_peptides.intersection(prot[i : i + length] for i in range(len(prot) - length + 1)))
+    return found_peptides
+
 def write_empty_files(args: argparse.Namespace):
     """Write empty files to the output directory."""
     open(f"{args.prefix}.tsv", "w").close()
@@ -737,6 +866,10 @@ def update_protein_variant_details_one_codon_triplet(
 
     return updated_variants, updated_consequences
 
+def join_unique_values(values) -> str:
+    """Join the unique non-empty values in sorted order, e.g. ["ENSG2", "", "ENSG1", "ENSG2"] -> "ENSG1,ENSG2"."""
+    return ",".join(sorted(set(value for value in values if value)))
+
 def generate_fasta_output(output_filename: str, mutated_proteins: list, mutated_peptides_df: pd.DataFrame, flanking_region_size: int):
     """
     Generates a FASTA file from mutated protein sequences,
@@ -763,31 +896,34 @@ def generate_fasta_output(output_filename: str, mutated_proteins: list, mutated_
             entry["seq_wt"] = str(p)
         # If there are variations, we need to handle them separately
         else:
-            # Collect all genomic variant details, protein variant details and positions
-            variant_details_gene = []
-            variant_details_protein = []
-            variant_positions_protein = []
+            # Collect (protein position, genomic variant details, protein variant details, consequence) of all variants
+            variant_rows = []
             variant_consequences = []
 
             # Collect variant info
             for var_details in p.vars.values():
                 for variant_detail in var_details:
                     consequence = variant_detail.get_metadata("consequence")
-                    variant_consequences.append(consequence[0] if consequence else "unknown")
+                    consequence = consequence[0] if consequence else "unknown"
+                    variant_consequences.append(consequence)
                     for coding_variant in variant_detail.coding.values():
-                        variant_details_gene.append(coding_variant.cdsMutationSyntax)
-                        variant_details_protein.append(coding_variant.aaMutationSyntax)
-                        variant_positions_protein.append(coding_variant.protPos + 1)  # Convert to 1-based index
-
-            # Sort all lists based on variant_positions_protein
-            if variant_positions_protein:
-                sorted_indices = sorted(range(len(variant_positions_protein)), key=lambda i: variant_positions_protein[i])
-                if len(variant_details_gene) == len(sorted_indices):
-                    variant_details_gene = [variant_details_gene[i] for i in sorted_indices]
-                variant_details_protein = [variant_details_protein[i] for i in sorted_indices]
-                variant_positions_protein = [variant_positions_protein[i] for i in sorted_indices]
-                if len(variant_consequences) == len(sorted_indices):
-                    variant_consequences = [variant_consequences[i] for i in sorted_indices]
+                        variant_rows.append(
+                            (
+                                coding_variant.protPos + 1,  # Convert to 1-based index
+                                coding_variant.cdsMutationSyntax,
+                                coding_variant.aaMutationSyntax,
+                                consequence,
+                            )
+                        )
+
+            # Sort the variant details by protein position in a single pass
+            variant_rows.sort(key=lambda row: row[0])
+            variant_positions_protein = [row[0] for row in variant_rows]
+            variant_details_gene = [row[1] for row in variant_rows]
+            variant_details_protein = [row[2] for row in variant_rows]
+            # Consequences are collected per variant, they can only be sorted along if each variant has a single coding entry
+            if len(variant_consequences) == len(variant_rows):
+                variant_consequences = [row[3] for row in variant_rows]
 
             # Validation for proteins with multiple variants, single mutations will always pass this test
             valid = True
@@ -798,11 +934,9 @@ def generate_fasta_output(output_filename: str, mutated_proteins: list, mutated_
             # positions = [50, 64, 71] --> one peptide could span all mutations in theory
             # invalid:
             # positions = [50, 64, 80] --> too far apart, 50 and 80 can not be covered by one peptide, the [50, 64] will appear separatey in the mutated proteins list
-            for i in variant_positions_protein:
-                for j in variant_positions_protein:
-                    if i != j and abs(i - j) > flanking_region_size:
-                        valid = False
-                        break
+            # the largest distance between any two positions is the distance between the outermost positions
+            if variant_positions_protein and max(variant_positions_protein) - min(variant_positions_protein) > flanking_region_size:
+                valid = False
             if valid:
                 # Create a variant entry for the FASTA dict
                 variant_entry = {
@@ -860,53 +994,57 @@ def generate_fasta_output(output_filename: str, mutated_proteins: list, mutated_
     # Remove entries whithout variants
     fasta_dict = {k: v for k, v in fasta_dict.items() if v["variants"]}
 
-    # Get a dataframe to look-up peptides by transcript --> to obtain meta data such as uniprot, ensembl IDs, protein variant notation
-    peptides_df_for_lookup = mutated_peptides_df.iloc[:, 1:-1].drop_duplicates()
+    # Get a dataframe to look-up peptides by transcript --> to obtain meta data such as uniprot, ensembl gene and protein IDs
+    # Only these columns are written to the headers, selecting them keeps the deduplication narrow
+    peptides_df_for_lookup = mutated_peptides_df[["transcripts", "uniprot", "gene", "proteins"]].drop_duplicates()
+
+    # Aggregate the meta data of all peptides per transcript at once, restricted to the transcripts written to the FASTA file
+    peptides_df_for_lookup = peptides_df_for_lookup[peptides_df_for_lookup["transcripts"].isin(fasta_dict.keys())]
+    transcript_metadata = (
+        peptides_df_for_lookup.groupby("transcripts")[["uniprot", "gene", "proteins"]].agg(join_unique_values).to_dict(orient="index")
+    )
 
     # Add metadata to the FASTA dict
     for transcript_id, entry in fasta_dict.items():
-        # Get the relevant peptide information for this transcript
-        peptides_for_transcript = peptides_df_for_lookup[peptides_df_for_lookup["transcripts"] == transcript_id]
         # If no peptides are found for this transcript, skip to the next one (meta data is optional)
-        if peptides_for_transcript.empty:
+        if transcript_id not in transcript_metadata:
             continue
-        # Small function to join unique values from a Series or DataFrame
-        def unique_join(obj):
-            if isinstance(obj, str):
-                obj = obj.split(",") # split comma-separated values
-            obj = [i for i in obj if i]
-            return ",".join(sorted(set(obj))) if obj else ""
         # Fill fasta dict with metadata (Uniprot, Ensembl gene & protein IDs)
         # They are assumed to be the same for wt & all mutations of a transcript
-        fasta_dict[transcript_id]["uniprot"] = unique_join(peptides_for_transcript["uniprot"])
-        fasta_dict[transcript_id]["ensembl_gene"] = unique_join(peptides_for_transcript["gene"])
-        fasta_dict[transcript_id]["ensembl_protein"] = unique_join(peptides_for_transcript["proteins"])
+        entry["uniprot"] = transcript_metadata[transcript_id]["uniprot"]
+        entry["ensembl_gene"] = transcript_metadata[transcript_id]["gene"]
+        entry["ensembl_protein"] = transcript_metadata[transcript_id]["proteins"]
 
-    # Write the FASTA file
-    with open(output_filename, "w") as protein_outfile:
+    def fasta_lines():
+        """Yield the lines of all FASTA entries, entries that cannot be formatted are skipped."""
         for transcript, entry in fasta_dict.items():
             try:
                 # Construct common header parts, if a meta data field is missing, it will be empty
                 header_start = f">epi|{entry['uniprot'] if ('uniprot' in entry and entry['uniprot']) else transcript}_"
                 header_middle = f"{entry['ensembl_gene'] if 'ensembl_gene' in entry else ''}|{transcript}|{entry['ensembl_protein'] if 'ensembl_protein' in entry else ''}|{entry['uniprot'] if 'uniprot' in entry else ''}"
-                # Write the wildtype sequence if available
+                entry_lines = []
+                # Add the wildtype sequence if available
                 if entry["seq_wt"]:
-                    protein_outfile.write(f"{header_start}wt|{header_middle}\n")
-                    protein_outfile.write(f"{entry['seq_wt']}\n")
-                # Write the mutated sequences
+                    entry_lines.append(f"{header_start}wt|{header_middle}\n")
+                    entry_lines.append(f"{entry['seq_wt']}\n")
+                # Add the mutated sequences
                 for i, variant in enumerate(entry["variants"]):
-                    protein_outfile.write(f"{header_start}mut_{i+1}|{header_middle}|{variant['consequences']}|{variant['details_gene']}|{variant['details_protein'] if 'details_protein' in variant else 'unknown'}\n")
-                    protein_outfile.write(f"{variant['seq']}\n")
+                    entry_lines.append(f"{header_start}mut_{i+1}|{header_middle}|{variant['consequences']}|{variant['details_gene']}|{variant['details_protein'] if 'details_protein' in variant else 'unknown'}\n")
+                    entry_lines.append(f"{variant['seq']}\n")
             except Exception as e:
                 logger.error(f"Error writing FASTA entry for transcript {transcript}: {e}")
+                continue
+            yield from entry_lines
+
+    # Write the FASTA file in a single pass over all entries
+    with open(output_filename, "w") as protein_outfile:
+        protein_outfile.writelines(fasta_lines())
     logger.info(f"FASTA file successfully generated: {output_filename}")
 
 def __main__():
     args = parse_args()
     logger.info("Running variant prediction version: " + str(VERSION))
 
-    global transcriptProteinTable
-
     # Read VCF file
     variant_list, transcripts, variants_metadata = read_vcf(args.input)
 
@@ -921,12 +1059,19 @@ def __main__():
     # initialize MartsAdapter
     # in previous version, these were the defaults "GRCh37": "http://feb2014.archive.ensembl.org" (broken)
     # "GRCh38": "http://apr2018.archive.ensembl.org" (different dataset table scheme, could potentially be fixed on BiomartAdapter level if needed )
-    martsadapter = MartsAdapter(biomart=args.genome_reference)
+    martsadapter = CachedMartsAdapter(biomart=args.genome_reference)
     # Create a mapping of transcript IDs to ensembl, refseq, and uniprot IDs
-    transcriptProteinTable = martsadapter.get_protein_ids_from_transcripts(transcripts, type=EIdentifierTypes.ENSEMBL)
+    protein_ids_df = martsadapter.get_protein_ids_from_transcripts(transcripts, type=EIdentifierTypes.ENSEMBL)
+    # Index the mapping by transcript ID once, e.g. {"ENST01": {"ensembl_id": [...], "refseq_id": [...], "uniprot_id": [...]}}
+    if protein_ids_df is None:
+        transcript_protein_table = None
+    else:
+        transcript_protein_table = protein_ids_df.groupby("transcript_id").agg(list).to_dict(orient="index")
 
     # Generate mutated peptides from variants
-    mutated_peptides_df, mutated_proteins = generate_peptides_from_variants( variant_list, martsadapter, variants_metadata, args.min_length, args.max_length + 1)
+    mutated_peptides_df, mutated_proteins = generate_peptides_from_variants(
+        variant_list, martsadapter, variants_metadata, args.min_length, args.max_length + 1, transcript_protein_table, args.cpus
+    )
 
     # Check if mutated_peptides_df is empty after filtering and write empty files
     if mutated_peptides_df.empty:
@@ -938,7 +1083,8 @@ def __main__():
         fasta_dict = parse_fasta(args.proteome_reference)
         num_mutated_peptides_pre_filter = mutated_peptides_df.shape[0]
         # filter out peptides found in reference proteome
-        mutated_peptides_df = mutated_peptides_df[mutated_peptides_df["sequence"].apply(lambda pep: any([pep in prot for prot in fasta_dict.values()]))]
+        peptides_in_proteome = find_peptides_in_proteome(mutated_peptides_df["sequence"].unique(), fasta_dict)
+        mutated_peptides_df = mutated_peptides_df[mutated_peptides_df["sequence"].isin(peptides_in_proteome)]
         logger.info(f"Filtered out {num_mutated_peptides_pre_filter - mutated_peptides_df.shape[0]} peptides that were found in the reference proteome.")
         if mutated_peptides_df.empty:
             write_empty_files(args)
@@ -230,12 +230,13 @@ class Utils:
 
         df[meta_columns] = df[meta_columns].apply(lambda col: col.map(try_numeric))
 
-        # Pivot to wide format
-        df_pivot = df.pivot_table(
-            index=meta_columns,
-            columns=['predictor', 'allele'],
-            values=['BA', 'rank', 'binder'],
-            aggfunc='first'  # Assuming first occurrence is enough if duplicates exist
+        # Unstack to wide format, keeping the first prediction if duplicates exist
+        df_predicted = df.dropna(subset=['predictor', 'allele']).drop_duplicates(subset=meta_columns + ['predictor', 'allele'])
+        df_pivot = (
+            df_predicted.set_index(meta_columns + ['predictor', 'allele'])[['BA', 'rank', 'binder']]
+                .unstack(['predictor', 'allele'])
+                .dropna(axis=1, how='all')
+                .sort_index(axis=1)
         )
 
         # Flatten the MultiIndex columns
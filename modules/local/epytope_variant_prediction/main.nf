@@ -31,6 +31,7 @@ process EPYTOPE_VARIANT_PREDICTION {
         --max_length ${max_length} \
         --min_length ${min_length} \
         --flanking_region_size ${flanking_region_size} \
+        --cpus ${task.cpus} \
         $args
 
     cat <<-END_VERSIONS > versions.yml
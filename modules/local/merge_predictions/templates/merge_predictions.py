@@ -109,17 +109,20 @@ class Version:
 # -------------------------------------------
 #           Utility Functions
 # -------------------------------------------
+MAX_IC50 = 50000
+LOG10_MAX_IC50 = np.log10(MAX_IC50)
+
 class Utils:
     @staticmethod
-    def ic50toBA(ic50: float) -> float:
-        """Scale IC50 to binding affinity (BA) ranging between 0-1."""
-        ic50 = min(ic50, 50000)  # Cap IC50 at 50000
-        return 1 - (math.log10(ic50)/math.log10(50000))
+    def ic50toBA(ic50: np.ndarray) -> np.ndarray:
+        """Scale IC50 values to binding affinity (BA) ranging between 0-1."""
+        ic50 = np.minimum(ic50, MAX_IC50)  # Cap IC50 at 50000
+        return 1 - (np.log10(ic50)/LOG10_MAX_IC50)
 
     @staticmethod
     def BAtoic50(BA: float) -> float:
         """Convert binding affinity (BA) to IC50."""
-        return 10 ** ((1 - BA) * math.log10(50000))
+        return 10 ** ((1 - BA) * math.log10(MAX_IC50))
 
 # -------------------------------------------
 #           Parse Predictions
@@ -141,21 +144,19 @@ class PredictionResult:
         |    ...   |   ...   |  ...  |  ...  |  ...   |     ...   |
         +----------+---------+-------+-------+--------+-----------+
         """
-        if 'mhcflurry' in self.file_path:
-            self.predictor = 'mhcflurry'
-            return self._format_mhcflurry_prediction()
-        elif 'mhcnuggets' in self.file_path:
-            self.predictor = 'mhcnuggetsii' if 'mhcnuggetsii' in self.file_path else 'mhcnuggets'
-            return self._format_mhcnuggets_prediction()
-        elif 'netmhcpan' in self.file_path:
-            self.predictor = 'netmhcpan'
-            return self._format_netmhcpan_prediction()
-        elif 'netmhciipan' in self.file_path:
-            self.predictor = 'netmhciipan'
-            return self._format_netmhciipan_prediction()
-        else:
+        # Formatter per predictor name in the file name, mhcnuggetsii has to be checked before mhcnuggets
+        formatters = {
+            'mhcflurry': self._format_mhcflurry_prediction,
+            'mhcnuggetsii': self._format_mhcnuggets_prediction,
+            'mhcnuggets': self._format_mhcnuggets_prediction,
+            'netmhcpan': self._format_netmhcpan_prediction,
+            'netmhciipan': self._format_netmhciipan_prediction,
+        }
+        self.predictor = next((predictor for predictor in formatters if predictor in self.file_path), None)
+        if self.predictor is None:
             logging.error(f'Unsupported predictor type in file: {self.file_path}.')
             sys.exit(1)
+        return formatters[self.predictor]()
 
     def _format_mhcflurry_prediction(self) -> pd.DataFrame:
         """
@@ -163,9 +164,9 @@ class PredictionResult:
         `peptide,allele,mhcflurry_affinity,mhcflurry_affinity_percentile,mhcflurry_processing_score,
         mhcflurry_presentation_score,mhcflurry_presentation_percentile`
         """
-        df = pd.read_csv(self.file_path)
+        df = pd.read_csv(self.file_path, usecols=['peptide', 'allele', 'mhcflurry_affinity', 'mhcflurry_presentation_percentile'])
         # Convert IC50 to BA
-        df['BA'] = df['mhcflurry_affinity'].apply(Utils.ic50toBA)
+        df['BA'] = Utils.ic50toBA(df['mhcflurry_affinity'].to_numpy())
         # Harmonize df to desired output structure
         df.rename(columns={'peptide': self.peptide_col_name, 'mhcflurry_presentation_percentile': 'rank'}, inplace=True)
         df = df[[self.peptide_col_name, 'allele', 'rank', 'BA']]
@@ -178,80 +179,63 @@ class PredictionResult:
         """Read in mhcnuggets prediction output comprising the columns `peptide,ic50,human_proteome_rank,allele`"""
         df = pd.read_csv(self.file_path)
         # Convert IC50 to BA
-        df['BA'] = df['ic50'].apply(Utils.ic50toBA)
+        df['BA'] = Utils.ic50toBA(df['ic50'].to_numpy())
         # Harmonize df to desired output structure
         df.rename(columns={'peptide': self.peptide_col_name, 'human_proteome_rank': 'rank'}, inplace=True)
         df = df[[self.peptide_col_name, 'allele', 'rank', 'BA']]
         # In rare cases mhcnuggets puts NaN in the rank column, eventhough binding affinity is available
-        df['rank'] = df['rank'].replace({np.nan: np.inf})
+        df['rank'] = df['rank'].fillna(np.inf)
         # Use IC50 < 500 as threshold since mhcnuggets provides a different ranking compared to other predictors
         df['binder'] = df['BA'] >= PredictorBindingThreshold.MHCNUGGETS.value
         df['predictor'] = self.predictor
 
         return df
 
+    def _reshape_netmhc_prediction(self, df: pd.DataFrame, rank_col: str, ba_col: str) -> pd.DataFrame:
+        """
+        Reshape the wide NetMHC output with one rank and BA column per allele
+        (`rank_col`, `rank_col.1`, ..) to one row per peptide and allele.
+        """
+        # Duplicated input peptides share the same prediction
+        df = df.drop_duplicates(self.peptide_col_name).sort_values(self.peptide_col_name)
+        # Columns are ordered by allele index, which maps onto the sorted alleles (possibly with duplicates)
+        rank_cols = df.columns[df.columns.str.startswith(rank_col)]
+        ba_cols = df.columns[df.columns.str.startswith(ba_col)]
+        n_alleles = len(rank_cols)
+
+        return pd.DataFrame({
+            self.peptide_col_name: np.repeat(df[self.peptide_col_name].to_numpy(), n_alleles),
+            'allele': np.asarray(self.alleles)[np.tile(np.arange(n_alleles), len(df))],
+            'BA': df[ba_cols].to_numpy(dtype=float).ravel(),
+            'rank': df[rank_cols].to_numpy(dtype=float).ravel(),
+        })
+
     def _format_netmhcpan_prediction(self) -> pd.DataFrame:
-        # Map with allele index to allele name
-        alleles_dict = {i: allele for i, allele in enumerate(self.alleles)}
-        # Read the file into a DataFrame with no headers initially
-        df = pd.read_csv(self.file_path, sep='\t', skiprows=1)
-        # Extract Peptide, percentile rank, binding affinity
-        df = df[df.columns[df.columns.str.contains('Peptide|EL_Rank|BA-score')]]
-        df = df.rename(columns={'Peptide':self.peptide_col_name,'EL_Rank':'EL_Rank.0','BA-score':'BA-score.0'})
-        # to longformat based on .0|1|2..
-        df_long = pd.melt(
-            df,
-            id_vars=[self.peptide_col_name],
-            value_vars=[col for col in df.columns if col != self.peptide_col_name],
-            var_name='metric',
-            value_name='value',
-        )
-
-        # Extract the allele information (e.g., .0, .1, etc.)
-        df_long['allele'] = df_long['metric'].str.split('.').str[1]
-        df_long['metric'] = df_long['metric'].apply(lambda x: x.split('.')[0].replace('EL_Rank','rank').replace('BA-score','BA'))
-
-        # Pivot table to organize columns properly
-        df_pivot = df_long.pivot_table(index=[self.peptide_col_name, 'allele'], columns='metric', values='value').reset_index()
-        df_pivot['allele'] = [alleles_dict[int(index.strip('.'))] for index in df_pivot['allele']]
-        df_pivot['binder'] = df_pivot['rank'] <= PredictorBindingThreshold.NETMHCPAN.value
-        df_pivot['predictor'] = self.predictor
-        df_pivot.index.name = ''
-
-        return df_pivot
+        # Only parse the Peptide, percentile rank and binding affinity columns
+        df = pd.read_csv(self.file_path, sep='\t', skiprows=1,
+                         usecols=lambda col: col == 'Peptide' or col.startswith(('EL_Rank', 'BA-score')))
+        df = df.rename(columns={'Peptide':self.peptide_col_name})
+        df = self._reshape_netmhc_prediction(df, 'EL_Rank', 'BA-score')
+        df['binder'] = df['rank'] <= PredictorBindingThreshold.NETMHCPAN.value
+        df['predictor'] = self.predictor
+
+        return df
 
     def _format_netmhciipan_prediction(self) -> pd.DataFrame:
         """
         Read in netmhciipan prediction output and extract the columns
         `Peptide,Rank,Score_BA` for multiple alleles.
         """
-        # Map with allele index to allele name. NetMHCIIpan sorts alleles alphabetically
-        alleles_dict = {i: allele for i, allele in enumerate(self.alleles)}
-        # Read the file into a DataFrame with no headers initially
-        df = pd.read_csv(self.file_path, sep='\t', skiprows=1)
-        # Extract Peptide, percentile rank, binding affinity
-        df = df[df.columns[df.columns.str.contains('Peptide|Rank(?!_BA)|Score_BA')]]
-        df = df.rename(columns={'Peptide':self.peptide_col_name,'Rank':'Rank.0','Score_BA':'Score_BA.0'})
-        # to longformat based on .0|1|2..
-        df_long = pd.melt(
-            df,
-            id_vars=[self.peptide_col_name],
-            value_vars=[col for col in df.columns if col != self.peptide_col_name],
-            var_name='metric',
-            value_name='value',
-        )
-        # Extract the allele information (e.g., .0, .1, etc.)
-        df_long['allele'] = df_long['metric'].str.split('.').str[1]
-        df_long['metric'] = df_long['metric'].apply(lambda x: x.split('.')[0].replace('Rank','rank').replace('Score_BA','BA'))
-
-        # Pivot table to organize columns properly
-        df_pivot = df_long.pivot_table(index=[self.peptide_col_name, 'allele'], columns='metric', values='value').reset_index()
-        df_pivot['allele'] = [alleles_dict[int(index.strip('.'))] for index in df_pivot['allele']]
-        df_pivot['binder'] = df_pivot['rank'] <= PredictorBindingThreshold.NETMHCIIPAN.value
-        df_pivot['predictor'] = self.predictor
-        df_pivot.index.name = ''
-
-        return df_pivot
+        # Only parse the Peptide, percentile rank and binding affinity columns
+        df = pd.read_csv(self.file_path, sep='\t', skiprows=1,
+                         usecols=lambda col: col == 'Peptide' or (col.startswith(('Rank', 'Score_BA')) and not col.startswith('Rank_BA')))
+        df = df.rename(columns={'Peptide':self.peptide_col_name})
+        # NetMHCIIpan sorts alleles alphabetically
+        df = self._reshape_netmhc_prediction(df, 'Rank', 'Score_BA')
+        df['binder'] = df['rank'] <= PredictorBindingThreshold.NETMHCIIPAN.value
+        df['predictor'] = self.predictor
+
+        return df
 
 def main():
     args = Arguments()
@@ -264,16 +248,18 @@ def main():
         logging.info(f"Writing {len(result.prediction_df)} {result.predictor} predictions to file..")
         output_df.append(result.prediction_df)
 
-    output_df = pd.concat(output_df)
-    # Normalize allele names
-    output_df['allele'] = output_df['allele'].apply(lambda x : mhcgnomes.parse(x).to_string())
+    output_df = pd.concat(output_df, ignore_index=True)
+    # Normalize allele names, parsing each distinct allele only once
+    normalized_alleles = {allele: mhcgnomes.parse(allele).to_string() for allele in output_df['allele'].unique()}
+    output_df['allele'] = output_df['allele'].map(normalized_alleles)
+    # Allele and predictor names repeat for every peptide, store them as categoricals for the merge
+    output_df = output_df.astype({'allele': 'category', 'predictor': 'category'})
 
     # Read in source file to annotate source metadata
     source_df = pd.read_csv(args.source_file, sep='\t')
-    # In the rare occurence that the source file has exactly the same col than output file, rename the source file column
-    source_df = source_df.rename(columns={col: col+'_metadata' for col in source_df.columns if col != args.peptide_col_name and col in output_df.columns})
-    # Merge the prediction results with the source file
-    output_df = pd.merge(source_df, output_df, on=args.peptide_col_name, how='left')
+    # Merge the prediction results with the source file. In the rare occurence that the source file has exactly
+    # the same col than output file, the source file column is suffixed with _metadata
+    output_df = pd.merge(source_df, output_df, on=args.peptide_col_name, how='left', suffixes=('_metadata', ''))
 
     # Write output file
     output_df.to_csv(f'{args.prefix}_predictions.csv', index=False)
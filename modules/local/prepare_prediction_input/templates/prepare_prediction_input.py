@@ -149,6 +149,8 @@ class Utils:
         Returns:
             tool_allele_input: List of supported alleles for the given tool
         """
+        # Supported alleles are listed in the json file, hash them once for constant time lookups
+        supported_alleles_tool = set(supported_alleles_tool)
         tool_allele_input = [allele for allele in allele_ls if allele in supported_alleles_tool]
         # Print warning if allele not in supported alleles
         logging.warning(f"Ignoring not supported alleles for {tool}: {set(allele_ls) - set(tool_allele_input)}")
@@ -159,12 +161,12 @@ class Utils:
 
         return tool_allele_input
 
-    def has_valid_aas(peptide: str) -> bool:
+    def has_valid_aas(peptides: pd.Series) -> pd.Series:
         """
-        Check if a peptide contains only valid amino acids.
+        Check which peptides contain only valid amino acids, in a single vectorized regex match.
         """
         valid_aas = "ACDEFGHIKLMNPQRSTVWY"
-        return all(aa in valid_aas for aa in peptide)
+        return peptides.str.fullmatch(f"[{valid_aas}]*", na=False)
 
     def filter_by_length(df: pd.DataFrame, min_length: int, max_length: int, peptide_col: str) -> pd.DataFrame:
         """Filter dataframe based on length constraints."""
@@ -187,7 +189,7 @@ def main():
     # Read input peptides and filter invalid amino acids
     df_input = pd.read_csv(args.input, sep="\t")
     logging.info(f"Read file with {len(df_input)} peptides.")
-    df_input = df_input[df_input[args.peptide_col_name].apply(Utils.has_valid_aas)]
+    df_input = df_input[Utils.has_valid_aas(df_input[args.peptide_col_name])]
 
     # Step 1: Apply *general MHC class length filtering* before tool-specific filtering
     min_length = args.min_peptide_length_classI if args.mhc_class == "I" else args.min_peptide_length_classII
@@ -228,7 +230,9 @@ def main():
                 df_tool.rename(columns={args.peptide_col_name: "peptide"}, inplace=True)
                 df_tool[['peptide', 'allele']].to_csv(f'{args.prefix}_{config["suffix"]}', index=False)
             else:
-                df_tool[[args.peptide_col_name]].to_csv(f'{args.prefix}_{config["suffix"]}', sep="\t", header=False, index=False)
+                # One peptide per line without header, peptides only contain valid amino acids and need no quoting
+                with open(f'{args.prefix}_{config["suffix"]}', 'w') as f:
+                    f.write('\\n'.join(df_tool[args.peptide_col_name]) + '\\n')
 
     # Parse versions
     versions_this_module = {}